@@ -1,52 +1,218 @@
 
 import asyncio
+import hashlib
 import logging
+import posixpath
+import random
+import re
+import secrets
+import shutil
+import signal
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, AbstractSet, Awaitable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+from xml.sax.saxutils import escape
 
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery
-from pptx import Presentation
-from pptx.util import Inches, Pt
 import aiohttp
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 import aiofiles
+from aiolimiter import AsyncLimiter
 import os
-from PIL import Image
 import io
 
+# python-pptx и Pillow тяжелые, поэтому импортируются внутри методов при первом использовании
+if TYPE_CHECKING:
+    from pptx.presentation import Presentation
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+PPTX_SIGNATURE = b"PK\x03\x04"
+SLIDE_PART_RE = re.compile(r"ppt/slides/slide(\d+)\.xml")
+
+# Пространства имен и типы частей OOXML для прямой записи слайдов в архив pptx
+NS = {
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "ct": "http://schemas.openxmlformats.org/package/2006/content-types",
+    "pr": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+SLIDE_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.slide+xml"
+SLIDE_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/slide"
+SLIDE_LAYOUT_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/slideLayout"
+
+# Слайд "Заголовок и объект": заголовок и маркированный список размером 18 pt
+CONTENT_SLIDE_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<p:sld xmlns:a="{a}" xmlns:r="{r}" xmlns:p="{p}"><p:cSld><p:spTree>'
+    '<p:nvGrpSpPr><p:cNvPr id="1" name=""/><p:cNvGrpSpPr/><p:nvPr/></p:nvGrpSpPr><p:grpSpPr/>'
+    '<p:sp><p:nvSpPr><p:cNvPr id="2" name="Title 1"/><p:cNvSpPr><a:spLocks noGrp="1"/></p:cNvSpPr>'
+    '<p:nvPr><p:ph type="title"/></p:nvPr></p:nvSpPr><p:spPr/>'
+    '<p:txBody><a:bodyPr/><a:lstStyle/>{{title}}</p:txBody></p:sp>'
+    '<p:sp><p:nvSpPr><p:cNvPr id="3" name="Content Placeholder 2"/><p:cNvSpPr><a:spLocks noGrp="1"/></p:cNvSpPr>'
+    '<p:nvPr><p:ph idx="1"/></p:nvPr></p:nvSpPr><p:spPr/>'
+    '<p:txBody><a:bodyPr/><a:lstStyle/>{{paragraphs}}</p:txBody></p:sp>'
+    '</p:spTree></p:cSld><p:clrMapOvr><a:masterClrMapping/></p:clrMapOvr></p:sld>'
+).format(**NS)
+CONTENT_PARAGRAPH_PROPERTIES_XML = '<a:pPr><a:defRPr sz="1800"/></a:pPr>'
+# Как в python-pptx: \n и \v становятся <a:br/>, остальные управляющие символы (недопустимые в XML) - _xHHHH_
+LINE_BREAK_RE = re.compile(r"\n|\v")
+CONTROL_CHAR_RE = re.compile(r"[\x00-\x08\x0B-\x1F]")
+SLIDE_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="{pr}"><Relationship Id="rId1" Type="{type}" Target="{{target}}"/></Relationships>'
+).format(pr=NS["pr"], type=SLIDE_LAYOUT_REL_TYPE)
+DOWNLOAD_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+# Тексты ответов на нажатия кнопок
+UPLOAD_PROMPT_TEXT = "Вы выбрали загрузку презентации. Пожалуйста, загрузите файл."
+CHOOSE_TEMPLATE_TEXT = "Выберите шаблон для вашей презентации."
+CREATE_NEW_TEXT = "Создание новой презентации."
+HELP_TEXT = "Это бот для создания и редактирования презентаций."
+UNKNOWN_COMMAND_TEXT = "Неверная команда. Попробуйте снова."
+
+# Клавиатуры не меняются, поэтому создаются один раз при импорте
+_START_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📤 Загрузить презентацию", callback_data="upload_presentation")],
+    [InlineKeyboardButton(text="🎨 Выбрать шаблон", callback_data="choose_template")],
+    [InlineKeyboardButton(text="✍️ Создать с нуля", callback_data="create_new")],
+    [InlineKeyboardButton(text="❓ Помощь", callback_data="help")]
+])
+_EDIT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="➕ Добавить слайд", callback_data="add_slide")],
+    [InlineKeyboardButton(text="🖼 Добавить изображение", callback_data="add_image")],
+    [InlineKeyboardButton(text="📝 Изменить текст", callback_data="edit_text")],
+    [InlineKeyboardButton(text="🎨 Изменить дизайн", callback_data="change_design")],
+    [InlineKeyboardButton(text="💾 Сохранить", callback_data="save")]
+])
+
 # Конфигурация
 class Config:
-    API_TOKEN = os.getenv("API_TOKEN", "7567293644:AAHVSPgyYAPt_NaUahhdID2njMK-FrtxaRg")  # Чтение токена из переменной окружения для безопасности
+    API_TOKEN = os.getenv("API_TOKEN", "")  # Токен задается только через переменную окружения
+    # Собственный сервер Bot API снимает ограничение облачного API на скачивание файлов (20 MB).
+    # В режиме --local сервер возвращает абсолютные пути к файлам: их нужно опубликовать
+    # по HTTP (например, через nginx) и указать шаблон адреса с {token} и {path}
+    TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER", "").rstrip("/")  # Например http://localhost:8081
+    TELEGRAM_API_FILE_URL = os.getenv("TELEGRAM_API_FILE_URL", "")
     MAX_FILE_SIZE = 500 * 1024 * 1024  # 500 MB
+    DOWNLOAD_CHUNK_SIZE = 256 * 1024  # 256 KB
+    MAX_CONCURRENT_DOWNLOADS = 16
+    DOWNLOAD_IO_THREADS = 8  # Потоки для записи скачиваемых файлов на диск
+    DOWNLOAD_CONNECT_TIMEOUT = 30  # секунд
+    DOWNLOAD_READ_TIMEOUT = 60  # секунд без данных от сервера
+    MESSAGES_PER_SECOND = 30  # Глобальный лимит Telegram на исходящие сообщения
+    PARALLEL_DOWNLOAD_THRESHOLD = 50 * 1024 * 1024  # 50 MB
+    PARALLEL_DOWNLOAD_PARTS = 8
+    DOWNLOAD_RETRIES = 5
+    IMAGE_MAX_SIDE = 1600  # Максимальная сторона изображения на слайде, px
+    IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64 MB уменьшенных изображений
+    STREAM_APPEND_THRESHOLD = 50  # Больше слайдов - запись напрямую в архив, минуя python-pptx
     DOWNLOAD_PATH = Path("downloads")
+    DOWNLOAD_DIR_MAX_BYTES = 10 * 1024 ** 3  # 10 GB
+    JANITOR_INTERVAL = 60  # секунд
     TEMPLATES_PATH = Path("templates")
 
-    # Создаем необходимые директории при запуске
-    DOWNLOAD_PATH.mkdir(parents=True, exist_ok=True)
-    TEMPLATES_PATH.mkdir(parents=True, exist_ok=True)
+    # Вебхук: если WEBHOOK_URL не задан, бот работает через long polling
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")  # Публичный адрес, например https://example.com
+    WEBHOOK_PATH = "/webhook"
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Если не задан, генерируется при каждом запуске
+    WEBHOOK_MAX_CONNECTIONS = 100
+    WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+    WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+    @classmethod
+    def ensure_dirs(cls) -> None:
+        """Создает необходимые директории"""
+        for path in (cls.DOWNLOAD_PATH, cls.TEMPLATES_PATH):
+            os.makedirs(path, exist_ok=True)
+
+
+# Текст ответа зависит от Config, поэтому задается после него
+FILE_TOO_LARGE_TEXT = f"⚠️ Файл слишком большой. Максимальный размер: {Config.MAX_FILE_SIZE // (1024 * 1024)} МБ"
+
+
+class FileTooLargeError(Exception):
+    """Файл превышает допустимый размер"""
+
+
+class RangeNotSupportedError(Exception):
+    """Сервер ответил на Range-запрос целым файлом"""
+
+
+class InvalidPresentationError(Exception):
+    """Файл не является презентацией pptx"""
 
 
 class PresentationManager:
     """Класс для управления презентациями"""
 
+    # Подготовленные изображения по SHA-256 исходного файла
+    _image_cache: "OrderedDict[str, Tuple[bytes, Tuple[int, int]]]" = OrderedDict()
+    _image_cache_bytes = 0
+    _image_cache_lock = threading.Lock()
+
     @staticmethod
-    async def create_presentation(template_name: Optional[str] = None) -> Presentation:
+    async def create_presentation(template_name: Optional[str] = None) -> "Presentation":
         """Создает новую презентацию или загружает шаблон"""
+        from pptx import Presentation
+
         if template_name:
             template_path = Config.TEMPLATES_PATH / template_name
             if template_path.exists():
-                return Presentation(template_path)
+                # Разбор pptx блокирует цикл событий, поэтому выполняется в отдельном потоке
+                return await asyncio.to_thread(Presentation, template_path)
             else:
                 raise FileNotFoundError(f"Шаблон {template_name} не найден.")
-        return Presentation()
+        # Пустая презентация тоже разбирается из встроенного default.pptx
+        return await asyncio.to_thread(Presentation)
+
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _read_template(template_path: Path, mtime_ns: int) -> bytes:
+        """Читает файл шаблона; результат кэшируется до изменения файла"""
+        return template_path.read_bytes()
+
+    @staticmethod
+    async def load_template_bytes(template_name: str) -> bytes:
+        """Возвращает содержимое шаблона без разбора через python-pptx"""
+        template_path = Config.TEMPLATES_PATH / template_name
+        if not template_path.exists():
+            raise FileNotFoundError(f"Шаблон {template_name} не найден.")
+        mtime_ns = template_path.stat().st_mtime_ns
+        return await asyncio.to_thread(PresentationManager._read_template, template_path, mtime_ns)
 
     @staticmethod
-    async def add_title_slide(prs: Presentation, title: str, subtitle: str = "") -> None:
+    def count_slides(file_path: Path) -> int:
+        """Считает слайды по оглавлению ZIP-архива, не разбирая XML"""
+        # Быстрая проверка сигнатуры, чтобы не искать оглавление в произвольном файле
+        with open(file_path, 'rb') as f:
+            if f.read(len(PPTX_SIGNATURE)) != PPTX_SIGNATURE:
+                raise InvalidPresentationError(f"{file_path.name}: не ZIP-архив")
+        try:
+            with zipfile.ZipFile(file_path) as z:
+                names = z.namelist()
+        except zipfile.BadZipFile as e:
+            raise InvalidPresentationError(f"{file_path.name}: поврежденный архив") from e
+        if "ppt/presentation.xml" not in names:
+            raise InvalidPresentationError(f"{file_path.name}: в архиве нет ppt/presentation.xml")
+        return sum(1 for name in names if SLIDE_PART_RE.fullmatch(name))
+
+    @staticmethod
+    async def add_title_slide(prs: "Presentation", title: str, subtitle: str = "") -> None:
         """Добавляет титульный слайд"""
         title_slide = prs.slides.add_slide(prs.slide_layouts[0])
         title_slide.shapes.title.text = title
@@ -54,8 +220,10 @@ class PresentationManager:
             title_slide.placeholders[1].text = subtitle
 
     @staticmethod
-    async def add_content_slide(prs: Presentation, title: str, content: List[str]) -> None:
+    async def add_content_slide(prs: "Presentation", title: str, content: List[str]) -> None:
         """Добавляет слайд с контентом"""
+        from pptx.util import Pt
+
         bullet_slide = prs.slides.add_slide(prs.slide_layouts[1])
         bullet_slide.shapes.title.text = title
 
@@ -66,8 +234,138 @@ class PresentationManager:
             p.font.size = Pt(18)
 
     @staticmethod
-    async def add_image_slide(prs: Presentation, title: str, image_path: str) -> None:
+    async def add_content_slides(file_path: Path, slides: List[Tuple[str, List[str]]]) -> None:
+        """Добавляет в файл презентации слайды с контентом из пар (заголовок, пункты)"""
+        if len(slides) > Config.STREAM_APPEND_THRESHOLD:
+            await asyncio.to_thread(PresentationManager.stream_append_slides, file_path, slides)
+            return
+
+        from pptx import Presentation
+
+        prs = await asyncio.to_thread(Presentation, file_path)
+        for title, content in slides:
+            await PresentationManager.add_content_slide(prs, title, content)
+        await asyncio.to_thread(prs.save, file_path)
+
+    @staticmethod
+    def stream_append_slides(file_path: Path, slides: Iterable[Tuple[str, List[str]]]) -> int:
+        """Дописывает слайды с контентом напрямую в ZIP-архив pptx, не строя объектную модель python-pptx.
+
+        Архив копируется по частям во временный файл, новые слайды пишутся по одному,
+        а [Content_Types].xml и связи презентации обновляются в конце.
+        Возвращает число добавленных слайдов.
+        """
+        from lxml import etree
+
+        content_types_part = "[Content_Types].xml"
+        presentation_part = "ppt/presentation.xml"
+        presentation_rels_part = "ppt/_rels/presentation.xml.rels"
+
+        def rels_part(part: str) -> str:
+            return posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+
+        def rel_target(rels, rel_id: str) -> str:
+            return rels.find(f"pr:Relationship[@Id='{rel_id}']", NS).get("Target")
+
+        tmp_path = file_path.with_name(file_path.name + ".tmp")
+        try:
+            with zipfile.ZipFile(file_path) as zin, zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zout:
+                content_types = etree.fromstring(zin.read(content_types_part))
+                presentation = etree.fromstring(zin.read(presentation_part))
+                presentation_rels = etree.fromstring(zin.read(presentation_rels_part))
+
+                # Макет берется так же, как в add_content_slide: второй макет первого образца слайдов
+                r_id = f"{{{NS['r']}}}id"
+                master_part = posixpath.normpath(posixpath.join("ppt", rel_target(
+                    presentation_rels, presentation.find("p:sldMasterIdLst/p:sldMasterId", NS).get(r_id)
+                )))
+                master = etree.fromstring(zin.read(master_part))
+                master_rels = etree.fromstring(zin.read(rels_part(master_part)))
+                layout_ids = master.findall("p:sldLayoutIdLst/p:sldLayoutId", NS)
+                layout_part = posixpath.normpath(posixpath.join(
+                    posixpath.dirname(master_part),
+                    rel_target(master_rels, layout_ids[min(1, len(layout_ids) - 1)].get(r_id)),
+                ))
+                slide_rels_xml = SLIDE_RELS_XML.format(target=posixpath.relpath(layout_part, "ppt/slides"))
+
+                # Копируем существующие части без распаковки в память целиком
+                patched = {content_types_part, presentation_part, presentation_rels_part}
+                slide_numbers = [0]
+                for item in zin.infolist():
+                    match = SLIDE_PART_RE.fullmatch(item.filename)
+                    if match:
+                        slide_numbers.append(int(match.group(1)))
+                    if item.filename in patched:
+                        continue
+                    info = zipfile.ZipInfo(item.filename, item.date_time)
+                    info.compress_type = item.compress_type
+                    info.external_attr = item.external_attr
+                    with zin.open(item) as src, zout.open(info, "w") as dst:
+                        shutil.copyfileobj(src, dst, Config.DOWNLOAD_CHUNK_SIZE)
+
+                sld_id_lst = presentation.find("p:sldIdLst", NS)
+                if sld_id_lst is None:
+                    # sldIdLst по схеме идет сразу после списков образцов
+                    sld_id_lst = etree.Element(f"{{{NS['p']}}}sldIdLst")
+                    lists = (presentation.find(f"p:{tag}", NS)
+                             for tag in ("sldMasterIdLst", "notesMasterIdLst", "handoutMasterIdLst"))
+                    [el for el in lists if el is not None][-1].addnext(sld_id_lst)
+                next_sld_id = max([255] + [int(el.get("id")) for el in sld_id_lst]) + 1
+                next_rel_id = max([0] + [
+                    int(rel.get("Id")[3:]) for rel in presentation_rels
+                    if rel.get("Id", "").startswith("rId") and rel.get("Id")[3:].isdigit()
+                ]) + 1
+                next_slide = max(slide_numbers) + 1
+
+                added = 0
+                for title, content in slides:
+                    slide_part = f"ppt/slides/slide{next_slide}.xml"
+                    # Пустой первый абзац плейсхолдера остается, как и в add_content_slide
+                    paragraphs = "<a:p/>" + "".join(
+                        PresentationManager._paragraph_xml(point, CONTENT_PARAGRAPH_PROPERTIES_XML) for point in content
+                    )
+                    # Заголовок, как TextFrame.text: каждая строка - отдельный абзац
+                    title_xml = "".join(PresentationManager._paragraph_xml(line) for line in title.split("\n"))
+                    zout.writestr(slide_part, CONTENT_SLIDE_XML.format(title=title_xml, paragraphs=paragraphs))
+                    zout.writestr(rels_part(slide_part), slide_rels_xml)
+
+                    etree.SubElement(content_types, f"{{{NS['ct']}}}Override",
+                                     PartName=f"/{slide_part}", ContentType=SLIDE_CONTENT_TYPE)
+                    etree.SubElement(presentation_rels, f"{{{NS['pr']}}}Relationship",
+                                     Id=f"rId{next_rel_id}", Type=SLIDE_REL_TYPE, Target=f"slides/slide{next_slide}.xml")
+                    etree.SubElement(sld_id_lst, f"{{{NS['p']}}}sldId", {"id": str(next_sld_id), r_id: f"rId{next_rel_id}"})
+                    next_slide += 1
+                    next_sld_id += 1
+                    next_rel_id += 1
+                    added += 1
+
+                for part, root in ((content_types_part, content_types),
+                                   (presentation_part, presentation),
+                                   (presentation_rels_part, presentation_rels)):
+                    zout.writestr(part, etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True))
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return added
+
+    @staticmethod
+    def _paragraph_xml(text: str, properties: str = "") -> str:
+        """Собирает абзац <a:p> из текста так же, как _Paragraph.text в python-pptx"""
+        parts = []
+        for idx, run_text in enumerate(LINE_BREAK_RE.split(text)):
+            if idx > 0:
+                parts.append("<a:br/>")
+            if run_text:
+                run_text = CONTROL_CHAR_RE.sub(lambda m: "_x%04X_" % ord(m.group()), run_text)
+                parts.append(f"<a:r><a:t>{escape(run_text)}</a:t></a:r>")
+        return f"<a:p>{properties}{''.join(parts)}</a:p>"
+
+    @staticmethod
+    async def add_image_slide(prs: "Presentation", title: str, image_path: str) -> None:
         """Добавляет слайд с изображением"""
+        from pptx.util import Inches
+
         img_slide = prs.slides.add_slide(prs.slide_layouts[5])
         img_slide.shapes.title.text = title
 
@@ -75,61 +373,159 @@ class PresentationManager:
         img_path = Path(image_path)
         if img_path.exists():
             left = top = Inches(1)
-            img_slide.shapes.add_picture(str(img_path), left, top)
+            image_bytes, size = await asyncio.to_thread(PresentationManager._prepare_image, img_path)
+            width, height = size if size else (None, None)
+            img_slide.shapes.add_picture(io.BytesIO(image_bytes), left, top, width, height)
         else:
             raise FileNotFoundError(f"Изображение по пути {image_path} не найдено.")
 
+    @staticmethod
+    def _prepare_image(path: Path, max_side: int = Config.IMAGE_MAX_SIDE) -> Tuple[bytes, Optional[Tuple[int, int]]]:
+        """Поворачивает изображение по EXIF и уменьшает до max_side с сохранением формата и физического размера.
+
+        Возвращает данные файла и размер картинки на слайде в EMU (None - размер из самого файла).
+        Одинаковые файлы обрабатываются один раз.
+        """
+        from PIL import ExifTags, Image, ImageOps
+        from pptx.util import Inches
+
+        data = path.read_bytes()
+        with Image.open(io.BytesIO(data)) as src:
+            original_side = max(src.size)
+            orientation = src.getexif().get(ExifTags.Base.Orientation, 1)
+            if original_side <= max_side and orientation == 1:
+                # Уменьшать и поворачивать нечего: файл попадает на слайд без изменений
+                return data, None
+
+            key = f"{hashlib.sha256(data).hexdigest()}:{max_side}"
+            cache = PresentationManager._image_cache
+            with PresentationManager._image_cache_lock:
+                if key in cache:
+                    cache.move_to_end(key)
+                    return cache[key]
+
+            # python-pptx вычисляет размер картинки на слайде по DPI файла (72, если не указан)
+            dpi = tuple(float(v) or 72.0 for v in src.info.get("dpi", (72, 72)))
+            if orientation in (5, 6, 7, 8):
+                # После поворота на 90° оси меняются местами
+                dpi = dpi[::-1]
+            # Для JPEG декодер сразу масштабирует DCT-блоки, не распаковывая все пиксели
+            src.draft(None, (max_side, max_side))
+            im = ImageOps.exif_transpose(src)
+            if im.mode in ("1", "P"):
+                # Палитровые изображения Pillow масштабирует без сглаживания
+                im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+            im.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            # Физический размер на слайде остается прежним: он передается в add_picture явно,
+            # а DPI в файле уменьшается вместе с пикселями
+            scale = max(im.size) / original_side
+            scaled_dpi = tuple(v * scale for v in dpi)
+            size = (Inches(im.width / scaled_dpi[0]), Inches(im.height / scaled_dpi[1]))
+
+            out = io.BytesIO()
+            if src.format == "JPEG":
+                if im.mode not in ("L", "RGB"):
+                    im = im.convert("RGB")
+                im.save(out, "JPEG", quality=82, optimize=True, progressive=True, dpi=scaled_dpi)
+            else:
+                # Остальные форматы (скриншоты, схемы) сохраняются без потерь
+                if im.mode not in ("L", "LA", "RGB", "RGBA"):
+                    im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+                im.save(out, "PNG", optimize=True, dpi=scaled_dpi)
+            result = (out.getvalue(), size)
+
+        # Кэш ограничен суммарным размером: одно изображение может весить мегабайты
+        if len(result[0]) <= Config.IMAGE_CACHE_MAX_BYTES:
+            with PresentationManager._image_cache_lock:
+                if key not in cache:
+                    cache[key] = result
+                    PresentationManager._image_cache_bytes += len(result[0])
+                while PresentationManager._image_cache_bytes > Config.IMAGE_CACHE_MAX_BYTES:
+                    _, (evicted, _) = cache.popitem(last=False)
+                    PresentationManager._image_cache_bytes -= len(evicted)
+        return result
+
 
 class PresentationBot:
     """Основной класс бота для работы с презентациями"""
 
+    # Ответы на кнопки стартового меню по значению callback_data
+    CALLBACK_REPLIES: Dict[str, str] = {
+        "upload_presentation": UPLOAD_PROMPT_TEXT,
+        "choose_template": CHOOSE_TEMPLATE_TEXT,
+        "create_new": CREATE_NEW_TEXT,
+        "help": HELP_TEXT,
+    }
+
     def __init__(self):
-        self.bot = Bot(token=Config.API_TOKEN)
+        if not Config.API_TOKEN:
+            raise RuntimeError("Не задана переменная окружения API_TOKEN")
+        self.bot = Bot(token=Config.API_TOKEN, session=self._make_api_session())
+        # Адрес файлов отличается только путем в конце: префикс с токеном форматируется один раз
+        api = self.bot.session.api
+        self._file_url_prefix: Optional[str] = (
+            api.file_url(Config.API_TOKEN, "") if api.file.endswith("{path}") and api.file.count("{path}") == 1 else None
+        )
         self.dp = Dispatcher()
         self.presentation_manager = PresentationManager()
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Ограничиваем число одновременных скачиваний, чтобы не исчерпать дескрипторы и память
+        self._dl_sem = asyncio.Semaphore(Config.MAX_CONCURRENT_DOWNLOADS)
+        # Запись на диск идет в отдельном пуле, чтобы не ждать за разбором презентаций и картинок
+        self._io_executor = ThreadPoolExecutor(max_workers=Config.DOWNLOAD_IO_THREADS, thread_name_prefix="download-io")
+        self._limiter = AsyncLimiter(Config.MESSAGES_PER_SECOND, 1)
+        # Путь к текущей презентации пользователя; разбирается python-pptx только при редактировании
+        self.user_presentations: Dict[int, Path] = {}
+        # Файлы, которые сейчас скачиваются или проверяются
+        self._active_files: Set[Path] = set()
         self.register_handlers()
 
+    @staticmethod
+    def _make_api_session() -> Optional[AiohttpSession]:
+        """Создает сессию aiogram для собственного сервера Bot API, если он задан"""
+        if not Config.TELEGRAM_API_SERVER:
+            return None
+        api = TelegramAPIServer.from_base(Config.TELEGRAM_API_SERVER)
+        if Config.TELEGRAM_API_FILE_URL:
+            api = TelegramAPIServer(base=api.base, file=Config.TELEGRAM_API_FILE_URL)
+        return AiohttpSession(api=api)
+
     def register_handlers(self):
         """Регистрация обработчиков команд и нажатий на кнопки"""
         self.dp.message.register(self.cmd_start, Command("start"))
-        self.dp.message.register(self.handle_document, lambda m: m.document is not None)
+        self.dp.message.register(self.handle_document, F.document)
         # Регистрируем обработку нажатий на инлайн-кнопки
-        self.dp.callback_query.register(self.handle_template_choice, lambda c: c.data.startswith('template_'))
-        self.dp.callback_query.register(self.handle_callback_queries)  # Обработка всех остальных callback
+        self.dp.callback_query.register(self.handle_template_choice, F.data.startswith('template_'))
+        self.dp.callback_query.register(self.handle_callback_queries, F.data.in_(self.CALLBACK_REPLIES))
+        self.dp.callback_query.register(self.handle_unknown_callback)  # Обработка всех остальных callback
 
     async def handle_callback_queries(self, callback: CallbackQuery):
-        """Обработчик всех нажатий на инлайн-кнопки"""
-        if callback.data == "upload_presentation":
-            await callback.message.answer("Вы выбрали загрузку презентации. Пожалуйста, загрузите файл.")
-        elif callback.data == "choose_template":
-            await callback.message.answer("Выберите шаблон для вашей презентации.")
-        elif callback.data == "create_new":
-            await callback.message.answer("Создание новой презентации.")
-        elif callback.data == "help":
-            await callback.message.answer("Это бот для создания и редактирования презентаций.")
-        else:
-            await callback.message.answer("Неверная команда. Попробуйте снова.")
+        """Обработчик нажатий на кнопки стартового меню"""
+        await self._send(callback.message.answer(self.CALLBACK_REPLIES[callback.data]))
+
+    async def handle_unknown_callback(self, callback: CallbackQuery):
+        """Обработчик нажатий на кнопки без отдельного обработчика"""
+        await self._send(callback.message.answer(UNKNOWN_COMMAND_TEXT))
+
+    async def _send(self, coro: Awaitable[T]) -> T:
+        """Отправляет сообщение с соблюдением лимита Telegram на исходящие запросы"""
+        async with self._limiter:
+            return await coro
 
     # ... other methods ...
 
     @staticmethod
     def get_start_keyboard() -> InlineKeyboardMarkup:
-        """Создает клавиатуру для начального меню"""
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📤 Загрузить презентацию", callback_data="upload_presentation")],
-            [InlineKeyboardButton(text="🎨 Выбрать шаблон", callback_data="choose_template")],
-            [InlineKeyboardButton(text="✍️ Создать с нуля", callback_data="create_new")],
-            [InlineKeyboardButton(text="❓ Помощь", callback_data="help")]
-        ])
-        return keyboard
+        """Возвращает клавиатуру для начального меню"""
+        return _START_KB
 
     async def cmd_start(self, message: Message):
         """Обработчик команды /start"""
-        await message.answer(
+        await self._send(message.answer(
             "👋 Добро пожаловать в Presentation Assistant Bot!\n\n"
             "Я помогу вам создать или отредактировать презентацию. Выберите действие:",
             reply_markup=self.get_start_keyboard()
-        )
+        ))
 
     async def handle_document(self, message: Message):
         """Обработка загруженной презентации"""
@@ -142,81 +538,351 @@ class PresentationBot:
         logger.info(f"Получен файл от {message.from_user.id}: {document.file_name} ({document.file_size} байт)")
 
         if document.file_size > Config.MAX_FILE_SIZE:
-            await message.answer(f"⚠️ Файл слишком большой. Максимальный размер: {Config.MAX_FILE_SIZE // (1024 * 1024)} МБ")
+            await self._send(message.answer(FILE_TOO_LARGE_TEXT))
             return
 
+        # Создаем уникальное имя файла
+        file_path = Config.DOWNLOAD_PATH / f"{message.from_user.id}_{self._safe_file_name(document.file_name)}"
+        # Пока файл скачивается и проверяется, очистка папки загрузок его не трогает
+        self._active_files.add(file_path)
+
         try:
             file_id = document.file_id
             file = await self.bot.get_file(file_id)
 
-            # Создаем уникальное имя файла
-            file_path = Config.DOWNLOAD_PATH / f"{message.from_user.id}_{document.file_name}"
-
             # Скачиваем файл
-            async with aiofiles.open(file_path, 'wb') as f:
-                await self.bot.download_file(file.file_path, f)
+            url = self._file_url(file.file_path)
+            await self.download_file(url, file_path, document.file_size)
 
-            # Открываем презентацию для проверки
-            prs = Presentation(file_path)
+            # Быстрая проверка: сигнатура ZIP и подсчет слайдов без полного разбора
+            slide_count = await asyncio.to_thread(self.presentation_manager.count_slides, file_path)
+            self.user_presentations[message.from_user.id] = file_path
 
-            await message.answer(
+            await self._send(message.answer(
                 f"✅ Презентация успешно загружена!\n"
-                f"📊 Количество слайдов: {len(prs.slides)}\n\n"
+                f"📊 Количество слайдов: {slide_count}\n\n"
                 "Выберите действие:",
                 reply_markup=self.get_edit_keyboard()
-            )
-
+            ))
+
+        except FileTooLargeError as e:
+            logger.warning(f"Загрузка прервана: {e}")
+            await self._send(message.answer(FILE_TOO_LARGE_TEXT))
+        except InvalidPresentationError as e:
+            logger.warning(f"Отклонен файл: {e}")
+            file_path.unlink(missing_ok=True)
+            await self._send(message.answer("❌ Файл не похож на презентацию PowerPoint (.pptx). Попробуйте другой файл."))
         except Exception as e:
             logger.error(f"Ошибка при обработке презентации: {e}")
-            await message.answer("❌ Произошла ошибка при обработке презентации. Попробуйте другой файл.")
+            await self._send(message.answer("❌ Произошла ошибка при обработке презентации. Попробуйте другой файл."))
+        finally:
+            self._active_files.discard(file_path)
+
+    def _file_url(self, file_path: str) -> str:
+        """Адрес для скачивания файла с сервера Bot API"""
+        if self._file_url_prefix is not None:
+            return self._file_url_prefix + file_path
+        # Шаблон с путем не в конце: форматируем целиком
+        return self.bot.session.api.file_url(Config.API_TOKEN, file_path)
+
+    @staticmethod
+    def _safe_file_name(file_name: Optional[str]) -> str:
+        """Оставляет от присланного клиентом имени только имя файла, без каталогов"""
+        name = Path((file_name or "").replace("\\", "/")).name
+        return name if name not in ("", ".", "..") else "presentation.pptx"
+
+    async def download_file(self, url: str, file_path: Path, file_size: int = 0) -> None:
+        """Скачивает файл на диск; большие файлы - параллельными Range-запросами"""
+        try:
+            async with self._dl_sem:
+                if file_size > Config.PARALLEL_DOWNLOAD_THRESHOLD and await self._download_ranges(url, file_path):
+                    return
+                await self._download_stream(url, file_path)
+        except BaseException:
+            # Не оставляем на диске недокачанный файл
+            file_path.unlink(missing_ok=True)
+            raise
+
+    async def _download_stream(self, url: str, file_path: Path) -> None:
+        """Потоково скачивает файл одним запросом, не буферизуя его в памяти целиком"""
+        loop = asyncio.get_running_loop()
+        downloaded = 0
+        fd = os.open(file_path, DOWNLOAD_OPEN_FLAGS, 0o644)
+        try:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            async with self._session.get(url, raise_for_status=True) as resp:
+                async for chunk in resp.content.iter_chunked(Config.DOWNLOAD_CHUNK_SIZE):
+                    downloaded += len(chunk)
+                    if downloaded > Config.MAX_FILE_SIZE:
+                        raise FileTooLargeError(f"{file_path.name}: больше {Config.MAX_FILE_SIZE} байт")
+                    await loop.run_in_executor(self._io_executor, self._write_all, fd, chunk)
+        finally:
+            os.close(fd)
+
+    async def _download_ranges(self, url: str, file_path: Path) -> bool:
+        """Скачивает файл частями параллельно. Возвращает False, если сервер не поддерживает Range"""
+        # Запись по смещениям требует os.pwrite, которого нет в Windows
+        if not hasattr(os, "pwrite"):
+            return False
+        try:
+            async with self._session.head(url) as resp:
+                if resp.status != 200:
+                    logger.info(f"HEAD вернул {resp.status}, файл будет скачан одним потоком")
+                    return False
+                size = resp.content_length
+                if not size or resp.headers.get("Accept-Ranges") != "bytes":
+                    return False
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # В адресе файла есть токен бота, поэтому в лог пишем только тип ошибки
+            logger.info(f"HEAD не удался ({type(e).__name__}), файл будет скачан одним потоком")
+            return False
+        if size > Config.MAX_FILE_SIZE:
+            raise FileTooLargeError(f"{file_path.name}: больше {Config.MAX_FILE_SIZE} байт")
+
+        fd = os.open(file_path, DOWNLOAD_OPEN_FLAGS, 0o644)
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._io_executor, self._preallocate, fd, size)
+
+            part_size = -(-size // Config.PARALLEL_DOWNLOAD_PARTS)
+            tasks = [
+                asyncio.create_task(self._download_range(url, fd, start, min(start + part_size, size) - 1))
+                for start in range(0, size, part_size)
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException as e:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if isinstance(e, RangeNotSupportedError):
+                    # Повторять бессмысленно: сервер не умеет отдавать части
+                    logger.info("Сервер проигнорировал Range, файл будет скачан одним потоком")
+                    return False
+                raise
+        finally:
+            os.close(fd)
+        return True
+
+    async def _download_range(self, url: str, fd: int, start: int, end: int) -> None:
+        """Скачивает диапазон байт [start, end] с повторами при ошибках сети и 5xx"""
+        loop = asyncio.get_running_loop()
+        headers = {"Range": f"bytes={start}-{end}"}
+        for attempt in range(Config.DOWNLOAD_RETRIES):
+            try:
+                async with self._session.get(url, headers=headers, raise_for_status=True) as resp:
+                    if resp.status != 206:
+                        raise RangeNotSupportedError(f"Ответ на Range-запрос: {resp.status}")
+                    written = 0
+                    async for chunk in resp.content.iter_chunked(Config.DOWNLOAD_CHUNK_SIZE):
+                        if written + len(chunk) > end - start + 1:
+                            raise aiohttp.ClientPayloadError("Сервер вернул больше данных, чем запрошено")
+                        await loop.run_in_executor(self._io_executor, self._pwrite_all, fd, chunk, start + written)
+                        written += len(chunk)
+                    if written != end - start + 1:
+                        raise aiohttp.ClientPayloadError(f"Получено {written} байт из {end - start + 1}")
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retriable = not isinstance(e, aiohttp.ClientResponseError) or e.status >= 500
+                if not retriable or attempt == Config.DOWNLOAD_RETRIES - 1:
+                    raise
+                # Экспоненциальная задержка со случайным разбросом
+                delay = 0.5 * 2 ** attempt
+                logger.warning(f"Повтор загрузки байт {start}-{end} через {delay:.1f} с: {type(e).__name__}")
+                await asyncio.sleep(delay + random.uniform(0, delay))
+
+    @staticmethod
+    def _preallocate(fd: int, size: int) -> None:
+        """Резервирует место под файл, чтобы части можно было писать по своим смещениям"""
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+
+    @staticmethod
+    def _write_all(fd: int, data: bytes) -> None:
+        """Записывает data целиком, дописывая при частичной записи"""
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+
+    @staticmethod
+    def _pwrite_all(fd: int, data: bytes, offset: int) -> None:
+        """Записывает data целиком по смещению offset, дописывая при частичной записи"""
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    async def _janitor(self) -> None:
+        """Периодически удаляет самые давние файлы, пока папка загрузок больше лимита"""
+        while True:
+            try:
+                removed = await asyncio.to_thread(
+                    self._evict_downloads, Config.DOWNLOAD_DIR_MAX_BYTES, frozenset(self._active_files)
+                )
+                if removed:
+                    removed_set = set(removed)
+                    for user_id, path in list(self.user_presentations.items()):
+                        if path in removed_set:
+                            del self.user_presentations[user_id]
+                    logger.info(f"Очистка загрузок: удалено файлов {len(removed)}")
+            except Exception as e:
+                logger.error(f"Ошибка при очистке загрузок: {e}")
+            await asyncio.sleep(Config.JANITOR_INTERVAL)
+
+    @staticmethod
+    def _evict_downloads(max_bytes: int, active: AbstractSet[Path] = frozenset()) -> List[Path]:
+        """Удаляет файлы с самым старым временем доступа, пока их суммарный размер больше max_bytes.
+
+        Файлы из active и временные *.tmp (запись еще идет) не удаляются, но учитываются в размере.
+        """
+        files = []
+        for path in Config.DOWNLOAD_PATH.iterdir():
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file():
+                files.append((st.st_atime, st.st_size, path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        removed = []
+        for _, size, path in files:
+            if total <= max_bytes:
+                break
+            if path in active or path.suffix == ".tmp":
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            removed.append(path)
+        return removed
 
     @staticmethod
     def get_edit_keyboard() -> InlineKeyboardMarkup:
-        """Создает клавиатуру для редактирования презентации"""
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="➕ Добавить слайд", callback_data="add_slide")],
-            [InlineKeyboardButton(text="🖼 Добавить изображение", callback_data="add_image")],
-            [InlineKeyboardButton(text="📝 Изменить текст", callback_data="edit_text")],
-            [InlineKeyboardButton(text="🎨 Изменить дизайн", callback_data="change_design")],
-            [InlineKeyboardButton(text="💾 Сохранить", callback_data="save")]
-        ])
-        return keyboard
+        """Возвращает клавиатуру для редактирования презентации"""
+        return _EDIT_KB
 
     async def handle_template_choice(self, callback: CallbackQuery):
         """Обработка выбора шаблона"""
         template_name = callback.data.replace('template_', '')
         try:
-            prs = await self.presentation_manager.create_presentation(f"{template_name}.pptx")
-            # Сохраняем временную презентацию
+            template_bytes = await self.presentation_manager.load_template_bytes(f"{template_name}.pptx")
+            # Сохраняем временную презентацию: шаблон копируется как есть,
+            # python-pptx понадобится только при редактировании
             temp_path = Config.DOWNLOAD_PATH / f"{callback.from_user.id}_temp.pptx"
-            prs.save(temp_path)
+            async with aiofiles.open(temp_path, 'wb') as f:
+                await f.write(template_bytes)
+            self.user_presentations[callback.from_user.id] = temp_path
 
-            await callback.message.answer(
+            await self._send(callback.message.answer(
                 "✅ Шаблон выбран успешно! Теперь вы можете:\n"
                 "1. Добавить контент\n"
                 "2. Изменить дизайн\n"
                 "3. Сохранить презентацию",
                 reply_markup=self.get_edit_keyboard()
-            )
+            ))
         except FileNotFoundError as e:
             logger.error(f"Ошибка создания презентации из шаблона: {e}")
-            await callback.message.answer(f"❌ Ошибка: {str(e)}")
+            await self._send(callback.message.answer(f"❌ Ошибка: {str(e)}"))
         except Exception as e:
             logger.error(f"Непредвиденная ошибка: {e}")
-            await callback.message.answer("❌ Произошла ошибка при создании презентации")
+            await self._send(callback.message.answer("❌ Произошла ошибка при создании презентации"))
 
     async def run(self):
         """Запуск бота"""
         logger.info("Запуск бота...")
+        # Пул потоков для разбора и сохранения презентаций
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=os.cpu_count()))
+        # Директории создаются при запуске, а не при импорте модуля
+        await asyncio.to_thread(Config.ensure_dirs)
+        janitor = asyncio.create_task(self._janitor())
+        # Сессия создается внутри работающего цикла событий и переиспользует
+        # соединения с api.telegram.org на все время работы бота
+        # Общего ограничения времени нет: большой файл на медленном канале может качаться долго,
+        # а зависшее соединение обрывается по таймауту чтения
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=32, keepalive_timeout=75, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=Config.DOWNLOAD_CONNECT_TIMEOUT,
+                sock_read=Config.DOWNLOAD_READ_TIMEOUT,
+            ),
+        )
         try:
-            await self.dp.start_polling(self.bot)
+            if Config.WEBHOOK_URL:
+                await self._run_webhook()
+            else:
+                # Оставшийся от запуска в режиме вебхука адрес мешает getUpdates
+                await self.bot.delete_webhook()
+                await self.dp.start_polling(self.bot)
         except Exception as e:
             logger.error(f"Ошибка при запуске бота: {e}")
         finally:
+            janitor.cancel()
+            await self._session.close()
             await self.bot.session.close()
+            self._io_executor.shutdown(wait=False)
+
+    async def _run_webhook(self) -> None:
+        """Прием обновлений через вебхук: Telegram доставляет их параллельно по нескольким соединениям"""
+        # Без секрета любой, кто знает адрес, может присылать поддельные обновления от имени пользователей
+        secret = Config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        app = web.Application()
+        SimpleRequestHandler(
+            dispatcher=self.dp, bot=self.bot, secret_token=secret
+        ).register(app, path=Config.WEBHOOK_PATH)
+        setup_application(app, self.dp, bot=self.bot)
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, Config.WEBAPP_HOST, Config.WEBAPP_PORT).start()
+            await self.bot.set_webhook(
+                url=Config.WEBHOOK_URL + Config.WEBHOOK_PATH,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=["message", "callback_query"],
+                secret_token=secret,
+            )
+            logger.info(f"Вебхук установлен: {Config.WEBHOOK_URL}{Config.WEBHOOK_PATH}")
+            # Работаем до SIGTERM/SIGINT, чтобы успеть снять вебхук и закрыть соединения
+            await self._wait_for_stop_signal()
+        finally:
+            await self.bot.delete_webhook()
+            await runner.cleanup()
+
+    @staticmethod
+    async def _wait_for_stop_signal() -> None:
+        """Ожидает SIGTERM или SIGINT"""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        signals = (signal.SIGTERM, signal.SIGINT)
+        try:
+            for sig in signals:
+                loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # В Windows обработчики сигналов цикла недоступны: остановка по KeyboardInterrupt
+            pass
+        try:
+            await stop.wait()
+        finally:
+            for sig in signals:
+                try:
+                    loop.remove_signal_handler(sig)
+                except NotImplementedError:
+                    pass
+        logger.info("Получен сигнал остановки")
 
 
 if __name__ == "__main__":
     bot = PresentationBot()
-    asyncio.run(bot.run())
+    # uvloop ускоряет цикл событий, если установлен
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(bot.run())
+    else:
+        uvloop.run(bot.run())
 
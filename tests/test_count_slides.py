@@ -0,0 +1,56 @@
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("aiogram")
+pptx = pytest.importorskip("pptx")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from config import InvalidPresentationError, PresentationManager  # noqa: E402
+
+
+@pytest.fixture
+def deck(tmp_path):
+    path = tmp_path / "deck.pptx"
+    prs = pptx.Presentation()
+    for _ in range(3):
+        prs.slides.add_slide(prs.slide_layouts[6])
+    prs.save(path)
+    return path
+
+
+def test_counts_slides(deck):
+    assert PresentationManager.count_slides(deck) == 3
+
+
+def test_counts_empty_presentation(tmp_path):
+    path = tmp_path / "empty.pptx"
+    pptx.Presentation().save(path)
+    assert PresentationManager.count_slides(path) == 0
+
+
+@pytest.mark.parametrize("content", [b"", b"%PDF-1.7\n", b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"])
+def test_rejects_wrong_signature(tmp_path, content):
+    path = tmp_path / "fake.pptx"
+    path.write_bytes(content)
+    with pytest.raises(InvalidPresentationError, match="не ZIP"):
+        PresentationManager.count_slides(path)
+
+
+def test_rejects_truncated_archive(deck):
+    data = deck.read_bytes()
+    deck.write_bytes(data[:len(data) // 2])
+    with pytest.raises(InvalidPresentationError, match="поврежденный"):
+        PresentationManager.count_slides(deck)
+
+
+def test_rejects_zip_without_presentation(tmp_path):
+    path = tmp_path / "other.pptx"
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("word/document.xml", "<w:document/>")
+        z.writestr("ppt/slides/slide1.xml", "<p:sld/>")
+    with pytest.raises(InvalidPresentationError, match="presentation.xml"):
+        PresentationManager.count_slides(path)
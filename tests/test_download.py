@@ -0,0 +1,176 @@
+import asyncio
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("aiogram")
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import config  # noqa: E402
+from config import Config, FileTooLargeError, PresentationBot  # noqa: E402
+
+
+DATA = os.urandom(3_000_001)
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)")
+PART_SIZE = -(-len(DATA) // 8)
+
+
+class FileServer:
+    """Отдает DATA; поведение для Range-запросов настраивается в тестах"""
+
+    def __init__(self, head_status=200, ignore_range=False, fail_times=0, fail_status=500,
+                 short=False, long=False, slow_start=None, fail_start=None):
+        self.head_status = head_status
+        self.ignore_range = ignore_range
+        self.fail_times = fail_times
+        self.fail_status = fail_status
+        self.short = short
+        self.long = long
+        self.slow_start = slow_start
+        self.fail_start = fail_start
+        self.requests = []
+
+    async def handle(self, request):
+        if request.method == "HEAD":
+            if self.head_status != 200:
+                return web.Response(status=self.head_status)
+            return web.Response(headers={"Content-Length": str(len(DATA)), "Accept-Ranges": "bytes"})
+
+        match = RANGE_RE.fullmatch(request.headers.get("Range", ""))
+        self.requests.append((int(match.group(1)), int(match.group(2))) if match else None)
+        if not match or self.ignore_range:
+            return web.Response(body=DATA)
+
+        start, end = int(match.group(1)), int(match.group(2))
+        if start == self.fail_start:
+            return web.Response(status=404)
+        if start == self.slow_start:
+            await asyncio.sleep(30)
+        if self.fail_times:
+            self.fail_times -= 1
+            return web.Response(status=self.fail_status)
+        body = DATA[start:end + 1]
+        if self.short:
+            body = body[:-1]
+        if self.long:
+            body += b"x"
+        return web.Response(status=206, body=body)
+
+
+@pytest.fixture(autouse=True)
+def _config(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "API_TOKEN", "1:test")
+    monkeypatch.setattr(Config, "PARALLEL_DOWNLOAD_THRESHOLD", 0)
+    monkeypatch.setattr(Config, "PARALLEL_DOWNLOAD_PARTS", 8)
+    monkeypatch.setattr(Config, "DOWNLOAD_RETRIES", 2)
+    monkeypatch.setattr(config.random, "uniform", lambda a, b: 0)
+    monkeypatch.chdir(tmp_path)
+
+
+def download(server, file_size=len(DATA)):
+    """Скачивает DATA через PresentationBot.download_file с локального сервера"""
+    async def run():
+        app = web.Application()
+        app.router.add_route("*", "/f", server.handle)
+        test_server = TestServer(app)
+        await test_server.start_server()
+        bot = PresentationBot()
+        bot._session = aiohttp.ClientSession()
+        try:
+            await bot.download_file(str(test_server.make_url("/f")), Path("out.bin"), file_size)
+        finally:
+            leftover = [t for t in asyncio.all_tasks() if t.get_coro().__name__ == "_download_range"]
+            await bot._session.close()
+            await bot.bot.session.close()
+            bot._io_executor.shutdown()
+            await test_server.close()
+        assert not leftover
+
+    asyncio.run(run())
+
+
+def test_parallel_ranges_cover_file():
+    server = FileServer()
+    download(server)
+
+    assert Path("out.bin").read_bytes() == DATA
+    ranges = sorted(server.requests)
+    assert len(ranges) == Config.PARALLEL_DOWNLOAD_PARTS
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(DATA) - 1
+    assert all(prev[1] + 1 == cur[0] for prev, cur in zip(ranges, ranges[1:]))
+
+
+def test_small_file_uses_single_stream(monkeypatch):
+    monkeypatch.setattr(Config, "PARALLEL_DOWNLOAD_THRESHOLD", len(DATA))
+    server = FileServer()
+    download(server)
+
+    assert Path("out.bin").read_bytes() == DATA
+    assert server.requests == [None]
+
+
+@pytest.mark.parametrize("head_status", [404, 405])
+def test_failed_head_falls_back_to_stream(head_status):
+    server = FileServer(head_status=head_status)
+    download(server)
+
+    assert Path("out.bin").read_bytes() == DATA
+    assert server.requests == [None]
+
+
+def test_ignored_range_falls_back_without_retries():
+    server = FileServer(ignore_range=True)
+    started = time.monotonic()
+    download(server)
+
+    assert Path("out.bin").read_bytes() == DATA
+    assert server.requests[-1] is None
+    assert len(server.requests) <= Config.PARALLEL_DOWNLOAD_PARTS + 1
+    assert time.monotonic() - started < 5
+
+
+def test_server_error_is_retried():
+    server = FileServer(fail_times=3)
+    download(server)
+
+    assert Path("out.bin").read_bytes() == DATA
+    assert len(server.requests) == Config.PARALLEL_DOWNLOAD_PARTS + 3
+
+
+def test_client_error_is_not_retried_and_cancels_siblings():
+    server = FileServer(fail_start=0, slow_start=PART_SIZE)
+    started = time.monotonic()
+    with pytest.raises(aiohttp.ClientResponseError):
+        download(server)
+
+    assert time.monotonic() - started < 10
+    assert server.requests.count((0, PART_SIZE - 1)) == 1
+    assert not Path("out.bin").exists()
+
+
+@pytest.mark.parametrize("mode", ["short", "long"])
+def test_wrong_part_length_fails_and_removes_file(mode):
+    server = FileServer(**{mode: True})
+    with pytest.raises(aiohttp.ClientPayloadError):
+        download(server)
+
+    assert not Path("out.bin").exists()
+    # Первая часть, исчерпавшая повторы, отменяет остальные
+    assert max(map(server.requests.count, server.requests)) == Config.DOWNLOAD_RETRIES
+
+
+def test_stream_aborts_over_max_file_size(monkeypatch):
+    monkeypatch.setattr(Config, "PARALLEL_DOWNLOAD_THRESHOLD", len(DATA))
+    monkeypatch.setattr(Config, "MAX_FILE_SIZE", 1000)
+    with pytest.raises(FileTooLargeError):
+        download(FileServer())
+
+    assert not Path("out.bin").exists()
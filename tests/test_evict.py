@@ -0,0 +1,48 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from config import Config, PresentationBot  # noqa: E402
+
+
+@pytest.fixture
+def downloads(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "DOWNLOAD_PATH", tmp_path)
+    files = {}
+    # Чем меньше номер, тем раньше к файлу обращались
+    for age, name in enumerate(["active.pptx", "upload.pptx.tmp", "old.pptx", "mid.pptx", "new.pptx"]):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (1_000_000 + age, 1_000_000 + age))
+        files[name] = path
+    (tmp_path / "subdir").mkdir()
+    return files
+
+
+def test_evicts_oldest_first_until_under_limit(downloads):
+    removed = PresentationBot._evict_downloads(300)
+
+    assert removed == [downloads["active.pptx"], downloads["old.pptx"]]
+    assert sorted(p.name for p in Config.DOWNLOAD_PATH.iterdir()) == [
+        "mid.pptx", "new.pptx", "subdir", "upload.pptx.tmp",
+    ]
+
+
+def test_skips_active_and_tmp_files(downloads):
+    removed = PresentationBot._evict_downloads(200, frozenset({downloads["active.pptx"]}))
+
+    # Пропущенные файлы все равно занимают место, поэтому удаляется больше остальных
+    assert removed == [downloads["old.pptx"], downloads["mid.pptx"], downloads["new.pptx"]]
+    assert downloads["active.pptx"].exists()
+    assert downloads["upload.pptx.tmp"].exists()
+
+
+def test_nothing_removed_under_limit(downloads):
+    assert PresentationBot._evict_downloads(500) == []
+    assert all(path.exists() for path in downloads.values())
@@ -0,0 +1,70 @@
+import asyncio
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("aiogram")
+pptx = pytest.importorskip("pptx")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from config import PresentationManager  # noqa: E402
+
+
+SLIDES = [
+    ("Обычный заголовок", ["первый пункт", "второй пункт"]),
+    ("Заголовок\nв две строки", ["line\nbreak", "soft\x0bbreak", "\nв начале", "в конце\x0b"]),
+    ("Спецсимволы <&>", ["<tag> & \"кавычки\"", "bell\x07 и esc\x1b", "cr\rlf", "tab\tтаб"]),
+    ("Пустой список", []),
+    ("", [""]),
+]
+
+
+def _read_slides(path):
+    prs = pptx.Presentation(path)
+    return [
+        (
+            slide.slide_layout.name,
+            slide.shapes.title.text_frame.text,
+            [(p.text, p.font.size) for p in slide.placeholders[1].text_frame.paragraphs],
+        )
+        for slide in prs.slides
+    ]
+
+
+@pytest.fixture
+def deck(tmp_path):
+    path = tmp_path / "base.pptx"
+    prs = pptx.Presentation()
+    prs.slides.add_slide(prs.slide_layouts[0]).shapes.title.text = "Существующий слайд"
+    prs.save(path)
+    return path
+
+
+def test_stream_append_matches_python_pptx(deck, tmp_path):
+    reference = tmp_path / "reference.pptx"
+    streamed = tmp_path / "streamed.pptx"
+    shutil.copyfile(deck, reference)
+    shutil.copyfile(deck, streamed)
+
+    prs = pptx.Presentation(reference)
+    for title, content in SLIDES:
+        asyncio.run(PresentationManager.add_content_slide(prs, title, content))
+    prs.save(reference)
+
+    assert PresentationManager.stream_append_slides(streamed, SLIDES) == len(SLIDES)
+
+    assert _read_slides(streamed) == _read_slides(reference)
+    assert PresentationManager.count_slides(streamed) == len(SLIDES) + 1
+
+
+def test_stream_append_result_can_be_edited_again(deck):
+    PresentationManager.stream_append_slides(deck, SLIDES)
+    PresentationManager.stream_append_slides(deck, SLIDES[:1])
+
+    prs = pptx.Presentation(deck)
+    prs.save(deck)
+    assert len(pptx.Presentation(deck).slides) == 2 * 1 + len(SLIDES)
+    assert not deck.with_name(deck.name + ".tmp").exists()